@@ -1,3 +1,4 @@
+import math
 import numpy as np
 
 C = 343  # Velocidad del sonido en m/s
@@ -23,24 +24,32 @@ def estimate_doa_from_tdoa(tdoa, d=0.1, c=C):
     asumiendo que 'theta_rad' es el ángulo con el eje del par de micrófonos.
 
     Parameters:
-    tdoa (float): Diferencia de tiempo de llegada en segundos.
+    tdoa (float o array-like): Diferencia de tiempo de llegada en segundos. Se puede
+                               pasar un array con los TDOAs de varios pares a la vez.
     d (float): Distancia entre los dos micrófonos en metros (por defecto 0.1m).
     c (float): Velocidad del sonido en m/s (por defecto usa la constante C).
 
     Returns:
-    float: Ángulo estimado en grados.
+    float o np.ndarray: Ángulo estimado en grados (un array si tdoa es un array).
     """
-    val = tdoa * c / d
-
-    # Control de dominio para np.arccos, que debe estar en [-1, 1]
+    # Control de dominio para arccos, que debe estar en [-1, 1]
     # Si val está fuera de este rango, significa que el TDOA medido es físicamente imposible
     # para la distancia 'd' dada, o hay mucho ruido.
-    if not (-1.0 <= val <= 1.0):
-        # print(f"ADVERTENCIA: Valor para arccos ({val:.4f}) fuera del rango [-1, 1]. TDOA={tdoa:.2e}s, d={d}m. Puede indicar TDOA no físico.")
-        # Se podría devolver NaN, un valor por defecto, o clampear. Clampeamos para obtener un ángulo.
-        pass # Se clampeará abajo con np.clip
-
-    val = np.clip(val, -1.0, 1.0)
+    # Se podría devolver NaN, un valor por defecto, o clampear. Clampeamos para obtener un ángulo.
+    # El clamp es sin saltos condicionales: min/max para un escalar, np.clip para arrays.
+    if np.ndim(tdoa) == 0:
+        # Escalar: se evita construir arrays de NumPy para un único valor.
+        # El producto se hace con np.float64 para que d=0 dé inf/nan como en el camino
+        # vectorizado (con floats de Python lanzaría ZeroDivisionError).
+        val = np.float64(tdoa) * c / d
+        if val != val:
+            return float('nan') # min/max no propagan NaN (np.clip sí): se devuelve aquí
+        val = min(1.0, max(-1.0, float(val)))
+        return math.degrees(math.acos(val))
+
+    # Vectorizado: con un array de TDOAs, np.clip y np.arccos se evalúan de una vez
+    # para todos los pares (funciones SIMD de NumPy) en lugar de escalar a escalar.
+    val = np.clip(np.asarray(tdoa) * c / d, -1.0, 1.0)
 
     theta_rad = np.arccos(val)    # Ángulo con el eje del par de micrófonos, en radianes.
                                   # Si tdoa es positivo, la señal llega primero al mic de referencia (implícito en el cálculo del tdoa).
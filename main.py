@@ -1,9 +1,11 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import soundfile as sf # Para load_rirs
+from scipy.fft import next_fast_len
 
 # Importar funciones de los módulos actualizados
-from tdoa import estimate_tdoa_cc, estimate_tdoa_gcc
+from tdoa import compute_spectra, estimate_tdoa_all_batch
 from doa import estimate_doa_from_tdoa, C # Importar C si se va a usar directamente aquí
 
 # Nota: La constante C también está definida en doa.py y es usada por defecto
@@ -11,6 +13,15 @@ from doa import estimate_doa_from_tdoa, C # Importar C si se va a usar directame
 # a menos que se quiera usar explícitamente en main.py para otros cálculos.
 # Por consistencia, podemos quitar la redefinición de C = 343 aquí si doa.py ya la tiene.
 
+def _read_rir(rir_filename):
+    """
+    Lee un archivo RIR .wav como float32. El archivo se abre directamente, sin
+    comprobar antes si existe: si no existe, open() lanza FileNotFoundError.
+    """
+    with open(rir_filename, 'rb') as f:
+        return sf.read(f, dtype='float32')
+
+
 def load_rirs(base_filepath_template, num_mics, config_suffix=""):
     """
     Carga las RIRs generadas por simulation.py desde archivos .wav.
@@ -18,6 +29,9 @@ def load_rirs(base_filepath_template, num_mics, config_suffix=""):
     Ejemplo: "rir_dataset_user_defined/rir_rt60_0.5_room_6x5x3.0_src_1x1x1.5_config_3.wav"
     donde "_config_3" es el config_suffix si se usa.
     La función quitará la extensión .wav, y luego añadirá _micidx_ y la extensión.
+    Los archivos se leen en paralelo (un hilo por micrófono) y se devuelven en una
+    matriz float32 M x N preasignada: una RIR (primer canal) por fila, rellenando
+    con ceros hasta la RIR más larga, lista para la FFT por lotes.
     """
     rirs = []
     fs_rir = -1  # Para almacenar la frecuencia de muestreo, asumimos que todas las RIRs la comparten
@@ -25,42 +39,81 @@ def load_rirs(base_filepath_template, num_mics, config_suffix=""):
     # Quitar la extensión .wav del template para construir nombres base correctos
     base_name_no_ext, _ = os.path.splitext(base_filepath_template)
 
-    for idx in range(num_mics):
-        # Construir el nombre de archivo específico para cada RIR de micrófono
-        rir_filename = f"{base_name_no_ext}_micidx_{idx}.wav"
-
-        if os.path.exists(rir_filename):
-            try:
-                rir_signal, current_fs = sf.read(rir_filename)
-                rirs.append(rir_signal)
-                if fs_rir == -1:
-                    fs_rir = current_fs
-                elif fs_rir != current_fs:
-                    print(f"ADVERTENCIA: Frecuencias de muestreo inconsistentes entre RIRs! {rir_filename} tiene {current_fs} Hz, se esperaba {fs_rir} Hz.")
-                    # Podría decidirse manejar este error de forma más estricta.
-            except Exception as e:
-                print(f"ADVERTENCIA: No se pudo leer el archivo RIR (aunque existe): {rir_filename}. Error: {e}")
-        else:
+    # Construir el nombre de archivo específico para cada RIR de micrófono
+    rir_filenames = [f"{base_name_no_ext}_micidx_{idx}.wav" for idx in range(num_mics)]
+
+    # Lanzar todas las lecturas a la vez para solapar la E/S de disco; los resultados
+    # (y las excepciones) se recogen después en orden de micrófono.
+    # float32 basta para estimar TDOA y reduce a la mitad el tráfico de memoria
+    # de las FFT (rfft conserva la precisión: float32 -> complex64)
+    with ThreadPoolExecutor(max_workers=max(1, num_mics)) as executor:
+        futures = [executor.submit(_read_rir, rir_filename) for rir_filename in rir_filenames]
+
+    for rir_filename, future in zip(rir_filenames, futures):
+        try:
+            rir_signal, current_fs = future.result()
+        except FileNotFoundError:
             print(f"ADVERTENCIA: Archivo RIR no encontrado: {rir_filename}")
+            continue
+        except Exception as e:
+            print(f"ADVERTENCIA: No se pudo leer el archivo RIR (aunque existe): {rir_filename}. Error: {e}")
+            continue
+
+        rirs.append(rir_signal)
+        if fs_rir == -1:
+            fs_rir = current_fs
+        elif fs_rir != current_fs:
+            print(f"ADVERTENCIA: Frecuencias de muestreo inconsistentes entre RIRs! {rir_filename} tiene {current_fs} Hz, se esperaba {fs_rir} Hz.")
+            # Podría decidirse manejar este error de forma más estricta.
 
     if not rirs:
         print(f"ERROR: No se cargaron RIRs para la base: {base_filepath_template}. Verifique los nombres de archivo y la salida de simulation.py.")
-        return [], -1 # Devolver lista vacía y fs inválida si no se carga nada.
+        return np.empty((0, 0), dtype=np.float32), -1 # Devolver matriz vacía y fs inválida si no se carga nada.
+
+    max_len = max(len(rir) for rir in rirs)
+    rirs_matrix = np.zeros((len(rirs), max_len), dtype=np.float32)
+    for idx, rir in enumerate(rirs):
+        # Asumimos que las RIRs son señales mono. Si son estéreo, tomar solo un canal.
+        if rir.ndim > 1: rir = rir[:, 0] # Tomar primer canal si es multicanal
+        rirs_matrix[idx, :len(rir)] = rir
+
+    return rirs_matrix, fs_rir
+
+def trim_silent_tails(rirs, threshold=1e-3):
+    """
+    Recorta la cola casi silenciosa de las RIRs (matriz M x N, una RIR por fila).
+    Se conserva hasta la última muestra cuya amplitud supera threshold veces el pico
+    de su propia RIR (1e-3 = -60 dB). Todas las filas se recortan a la misma
+    longitud (la mayor de las necesarias), así los pares siguen siendo comparables.
+    Devuelve una vista de la matriz recortada.
+    """
+    envelope = np.abs(rirs)
+    above = envelope > threshold * envelope.max(axis=1, keepdims=True)
+
+    # Última muestra por encima del umbral en cada fila (buscando desde el final)
+    last = rirs.shape[1] - np.argmax(above[:, ::-1], axis=1)
+    last[~above.any(axis=1)] = 0 # Una RIR nula no limita el recorte
 
-    return rirs, fs_rir
+    return rirs[:, :max(int(last.max()), 1)]
 
 
-def process_configuration(base_filepath_template, num_mics_in_config, mic_distance=0.1):
+def process_configuration(base_filepath_template, num_mics_in_config, mic_distance=0.1, workers=-1, engine='cpu'):
     """
     Procesa una configuración completa de RIRs: carga RIRs, estima TDOAs y DOAs
     entre pares consecutivos de micrófonos.
+    Los pares se procesan en paralelo dentro de las FFT por lotes, repartidos entre
+    'workers' hilos (-1 = todos los núcleos disponibles).
+    Con engine='cuda' las estimaciones de TDOA se hacen en GPU (requiere PyTorch).
     """
+    if engine not in ('cpu', 'cuda'):
+        raise ValueError("Motor no reconocido. Use 'cpu' o 'cuda'.")
+
     print(f"\nProcesando configuración basada en: {base_filepath_template}")
     print(f"Esperando {num_mics_in_config} micrófonos para esta configuración.")
 
     rirs, fs = load_rirs(base_filepath_template, num_mics_in_config)
 
-    if not rirs or fs == -1:
+    if len(rirs) == 0 or fs == -1:
         print(f"No se pudieron cargar RIRs o fs inválida para {base_filepath_template}. Abortando procesamiento para esta configuración.")
         return
 
@@ -76,33 +129,50 @@ def process_configuration(base_filepath_template, num_mics_in_config, mic_distan
 
     print(f"RIRs cargadas exitosamente. Frecuencia de muestreo: {fs} Hz.")
 
-    for i in range(actual_num_mics_loaded - 1):
-        # Asumimos que las RIRs son señales mono. Si son estéreo, tomar solo un canal.
-        sig1 = rirs[i]
-        if sig1.ndim > 1: sig1 = sig1[:, 0] # Tomar primer canal si es multicanal
+    # Las colas de las RIRs (decaimiento por debajo de -60 dB) apenas aportan a la
+    # correlación pero sí al coste de la FFT: se recortan antes de procesar.
+    original_len = rirs.shape[1]
+    rirs = trim_silent_tails(rirs)
+    print(f"RIRs recortadas de {original_len} a {rirs.shape[1]} muestras (cola por debajo de -60 dB).")
+
+    # Todas las RIRs (filas de la matriz) comparten longitud y fs: la longitud de la
+    # FFT y el vector de lags se calculan una sola vez para todos los pares y métodos.
+    # Los espectros de todas las RIRs se calculan con una sola FFT por lotes y se
+    # reutilizan entre pares y entre métodos.
+    n = next_fast_len(2 * rirs.shape[1] - 1, real=True)
+    lags_vector = (np.arange(n) - n // 2) / fs
+
+    pairs = [(i, i + 1) for i in range(actual_num_mics_loaded - 1)]
+
+    if engine == 'cuda':
+        # Import diferido: PyTorch sólo se necesita para el motor GPU
+        from tdoa_cuda import estimate_tdoa_gcc_cuda
+        tdoas = estimate_tdoa_gcc_cuda(rirs, pairs, fs, methods=('cc', 'phat', 'scot'), n=n)
+    else:
+        SIG, MAG, n = compute_spectra(rirs, n, workers=workers)
+
+        # CC, PHAT y SCOT de todos los pares en una sola llamada: los tres métodos
+        # comparten espectros y espectro cruzado; cada par es una fila de la IFFT por
+        # lotes, y las filas se reparten entre los hilos disponibles.
+        tdoas = estimate_tdoa_all_batch(SIG, MAG, pairs, n, fs, lags_vector=lags_vector, workers=workers)
+
+    tdoas_cc, tdoas_phat, tdoas_scot = tdoas['cc'], tdoas['phat'], tdoas['scot']
 
-        sig2 = rirs[i+1]
-        if sig2.ndim > 1: sig2 = sig2[:, 0] # Tomar primer canal si es multicanal
+    # Estimación de DOA para todos los pares a la vez (estimate_doa_from_tdoa está vectorizada)
+    # Usamos la constante C importada o definida en doa.py por defecto.
+    doas_cc = estimate_doa_from_tdoa(tdoas_cc, d=mic_distance)
+    doas_phat = estimate_doa_from_tdoa(tdoas_phat, d=mic_distance)
+    doas_scot = estimate_doa_from_tdoa(tdoas_scot, d=mic_distance)
 
-        print(f"\n  Calculando para par de micrófonos original: Mic {i} vs Mic {i+1}")
+    for k, (i, j) in enumerate(pairs):
+        print(f"\n  Calculando para par de micrófonos original: Mic {i} vs Mic {j}")
         # (Nota: si algunos micrófonos intermedios no se cargaron, los índices 'i' y 'i+1'
         # se refieren a los índices en la lista 'rirs' cargada, no necesariamente a los
         # índices originales absolutos si hubo fallos de carga no consecutivos)
 
-        # Estimación de TDOA
-        tdoa_cc_val = estimate_tdoa_cc(sig1, sig2, fs)
-        tdoa_phat_val = estimate_tdoa_gcc(sig1, sig2, fs, method='phat')
-        tdoa_scot_val = estimate_tdoa_gcc(sig1, sig2, fs, method='scot')
-
-        # Estimación de DOA
-        # Usamos la constante C importada o definida en doa.py por defecto.
-        doa_cc_val = estimate_doa_from_tdoa(tdoa_cc_val, d=mic_distance)
-        doa_phat_val = estimate_doa_from_tdoa(tdoa_phat_val, d=mic_distance)
-        doa_scot_val = estimate_doa_from_tdoa(tdoa_scot_val, d=mic_distance)
-
-        print(f"    TDOA CC:    {tdoa_cc_val*1e6:.2f} µs  | DOA: {doa_cc_val:.2f}°")
-        print(f"    TDOA PHAT:  {tdoa_phat_val*1e6:.2f} µs  | DOA: {doa_phat_val:.2f}°")
-        print(f"    TDOA SCOT:  {tdoa_scot_val*1e6:.2f} µs  | DOA: {doa_scot_val:.2f}°")
+        print(f"    TDOA CC:    {tdoas_cc[k]*1e6:.2f} µs  | DOA: {doas_cc[k]:.2f}°")
+        print(f"    TDOA PHAT:  {tdoas_phat[k]*1e6:.2f} µs  | DOA: {doas_phat[k]:.2f}°")
+        print(f"    TDOA SCOT:  {tdoas_scot[k]*1e6:.2f} µs  | DOA: {doas_scot[k]:.2f}°")
 
 
 if __name__ == "__main__":
@@ -2,6 +2,8 @@ import pyroomacoustics as pra
 import numpy as np
 import soundfile as sf
 import os
+import functools
+import multiprocessing
 import random # Mantendremos random por si el usuario quiere reintroducir aleatoriedad controlada más tarde
 
 def create_rir_example(base_output_filename, rt60_tgt, room_dim, source_pos, mic_positions, fs):
@@ -25,29 +27,25 @@ def create_rir_example(base_output_filename, rt60_tgt, room_dim, source_pos, mic
                 print(f"Skipping configuration for base {base_output_filename}: Source position {source_pos} is outside room dimensions {room_dim} or too close to walls.")
                 return files_created_count
 
-        # Validate microphone positions
-        original_mic_indices_to_process = []
-        mic_positions_for_pra = []
-
-        for idx, mic_coord in enumerate(mic_positions):
-            valid_for_dim = True
-            for i in range(3): # x, y, z
-                if not (margin <= mic_coord[i] < room_dim[i] - margin):
-                    print(f"INFO: Mic {idx} for base {base_output_filename}: Position {mic_coord} is outside room dimensions {room_dim} or too close to walls. It will be skipped.")
-                    valid_for_dim = False
-                    break
-            if not valid_for_dim:
-                continue
-
-            if np.linalg.norm(np.array(source_pos) - np.array(mic_coord)) < 0.1: # At least 0.1m apart
-                print(f"INFO: Mic {idx} for base {base_output_filename}: Position {mic_coord} is too close to source {source_pos}. It will be skipped.")
-                continue
-
-            # If valid so far
-            original_mic_indices_to_process.append(idx)
-            mic_positions_for_pra.append(mic_coord)
-
-        if not mic_positions_for_pra: # Renamed from valid_mic_positions
+        # Validate microphone positions (vectorized over all microphones at once)
+        mics = np.asarray(mic_positions, dtype=float)
+        room_limits = np.asarray(room_dim, dtype=float)
+        source = np.asarray(source_pos, dtype=float)
+
+        in_room = np.all((mics >= margin) & (mics < room_limits - margin), axis=1)
+        far_enough = np.linalg.norm(mics - source, axis=1) >= 0.1 # At least 0.1m apart
+        keep = in_room & far_enough
+
+        for idx in np.where(~keep)[0]:
+            if not in_room[idx]:
+                print(f"INFO: Mic {idx} for base {base_output_filename}: Position {mic_positions[idx]} is outside room dimensions {room_dim} or too close to walls. It will be skipped.")
+            else:
+                print(f"INFO: Mic {idx} for base {base_output_filename}: Position {mic_positions[idx]} is too close to source {source_pos}. It will be skipped.")
+
+        original_mic_indices_to_process = np.where(keep)[0].tolist()
+        mic_positions_for_pra = mics[keep]
+
+        if len(mic_positions_for_pra) == 0: # Renamed from valid_mic_positions
             print(f"Skipping configuration for base {base_output_filename}: No valid microphone positions remaining after validation.")
             return files_created_count
 
@@ -97,6 +95,55 @@ def create_rir_example(base_output_filename, rt60_tgt, room_dim, source_pos, mic
 
     return files_created_count
 
+def _run_cfg(indexed_config, fs, output_directory, num_configurations):
+    """
+    Runs a single entry of the configurations list; used as a multiprocessing.Pool task.
+
+    Parameters:
+    indexed_config (tuple): (index, config) pair, as produced by enumerate(configurations).
+    fs (int): Sampling frequency in Hz.
+    output_directory (str): Directory where the WAV files are saved.
+    num_configurations (int): Total number of configurations (for progress messages).
+
+    Returns:
+    int: Number of RIR files created for this configuration.
+    """
+    i, config = indexed_config
+    print(f"\nProcessing configuration {i+1}/{num_configurations}:")
+
+    rt60 = config.get("rt60_tgt")
+    room_dim = config.get("room_dim")
+    source_pos = config.get("source_pos")
+    mic_positions = config.get("mic_positions") # Cambiado de mic_pos
+    suffix = config.get("filename_suffix", f"config_{i+1}")
+
+    # Validar que los parámetros esenciales están presentes
+    if not all([rt60 is not None, room_dim, source_pos, mic_positions is not None]): # mic_positions puede ser lista vacía teóricamente
+        print(f"Skipping configuration {i+1}: Missing one or more required parameters (rt60_tgt, room_dim, source_pos, mic_positions).")
+        return 0
+    if not mic_positions: # Si la lista de mic_positions está vacía
+         print(f"Skipping configuration {i+1}: mic_positions list is empty.")
+         return 0
+
+    print(f"  RT60: {rt60}s, Room: {room_dim}, Source: {source_pos}, Mic_Positions: {mic_positions}")
+
+    # Construct base filename (sin el índice del micrófono, eso se añade en create_rir_example)
+    # Usamos solo el primer mic para el nombre base representativo, o podríamos omitirlo del nombre base.
+    # Por simplicidad, mantenemos una estructura similar.
+    base_filename = f"rir_rt60_{rt60}_room_{room_dim[0]}x{room_dim[1]}x{room_dim[2]}_src_{source_pos[0]}x{source_pos[1]}x{source_pos[2]}_{suffix}.wav"
+    base_filename = base_filename.replace(" ", "_").replace("[", "").replace("]", "").replace(",", "") # Sanitización básica
+
+    base_output_filepath = os.path.join(output_directory, base_filename)
+
+    return create_rir_example(
+        base_output_filename=base_output_filepath,
+        rt60_tgt=rt60,
+        room_dim=room_dim,
+        source_pos=source_pos,
+        mic_positions=mic_positions, # Pasando la lista de posiciones
+        fs=fs
+    )
+
 if __name__ == "__main__":
     # Script renamed from create_rir_dataset.py to simulation.py
     print("simulation.py (formerly create_rir_dataset.py) script started with user-defined configurations.")
@@ -171,42 +218,12 @@ if __name__ == "__main__":
     if not configurations:
         print("No configurations provided. Please add configurations to the 'configurations' list in the script.")
     else:
-        for i, config in enumerate(configurations):
-            print(f"\nProcessing configuration {i+1}/{len(configurations)}:")
-
-            rt60 = config.get("rt60_tgt")
-            room_dim = config.get("room_dim")
-            source_pos = config.get("source_pos")
-            mic_positions = config.get("mic_positions") # Cambiado de mic_pos
-            suffix = config.get("filename_suffix", f"config_{i+1}")
-
-            # Validar que los parámetros esenciales están presentes
-            if not all([rt60 is not None, room_dim, source_pos, mic_positions is not None]): # mic_positions puede ser lista vacía teóricamente
-                print(f"Skipping configuration {i+1}: Missing one or more required parameters (rt60_tgt, room_dim, source_pos, mic_positions).")
-                continue
-            if not mic_positions: # Si la lista de mic_positions está vacía
-                 print(f"Skipping configuration {i+1}: mic_positions list is empty.")
-                 continue
-
-            print(f"  RT60: {rt60}s, Room: {room_dim}, Source: {source_pos}, Mic_Positions: {mic_positions}")
-
-            # Construct base filename (sin el índice del micrófono, eso se añade en create_rir_example)
-            # Usamos solo el primer mic para el nombre base representativo, o podríamos omitirlo del nombre base.
-            # Por simplicidad, mantenemos una estructura similar.
-            base_filename = f"rir_rt60_{rt60}_room_{room_dim[0]}x{room_dim[1]}x{room_dim[2]}_src_{source_pos[0]}x{source_pos[1]}x{source_pos[2]}_{suffix}.wav"
-            base_filename = base_filename.replace(" ", "_").replace("[", "").replace("]", "").replace(",", "") # Sanitización básica
-
-            base_output_filepath = os.path.join(output_directory, base_filename)
-
-            num_created_for_this_config = create_rir_example(
-                base_output_filename=base_output_filepath,
-                rt60_tgt=rt60,
-                room_dim=room_dim,
-                source_pos=source_pos,
-                mic_positions=mic_positions, # Pasando la lista de posiciones
-                fs=fs
-            )
-            total_individual_rirs_generated += num_created_for_this_config
+        # Each configuration is independent and compute_rir() is CPU-bound, so the
+        # configurations are simulated in parallel, one worker process per core.
+        # Output lines from different configurations may interleave.
+        run_cfg = functools.partial(_run_cfg, fs=fs, output_directory=output_directory, num_configurations=len(configurations))
+        with multiprocessing.Pool() as pool:
+            total_individual_rirs_generated = sum(pool.imap_unordered(run_cfg, enumerate(configurations)))
 
 
     print(f"\n--- Dataset generation complete ---")
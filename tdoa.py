@@ -1,95 +1,334 @@
+import functools
+import os
+import threading
 import numpy as np
-from scipy.signal import correlate, correlation_lags
-from numpy.fft import fft, ifft, fftshift # Usar numpy.fft consistentemente
+from scipy.fft import fftshift, next_fast_len
+
+try:
+    # pyFFTW es opcional: si está instalado se usan los kernels SIMD de FFTW y se
+    # cachean los planes entre llamadas (útil en el bucle de pares de main.py).
+    import pyfftw
+    from pyfftw.interfaces.scipy_fft import rfft, irfft
+    pyfftw.interfaces.cache.enable()
+except ImportError:
+    pyfftw = None
+    from scipy.fft import rfft, irfft
+
+try:
+    # Numba es opcional: si está instalado, la ponderación PHAT/SCOT se hace con los
+    # kernels fusionados de tdoa_kernels.py en lugar de con operaciones de NumPy.
+    from tdoa_kernels import phat_normalize, scot_normalize
+except ImportError:
+    phat_normalize = scot_normalize = None
+
+FFT_WORKERS = -1  # Hilos para las FFT (-1 = todos los núcleos disponibles)
+
+# Esfuerzo del planificador de FFTW. FFTW_ESTIMATE planifica al instante; FFTW_MEASURE
+# tarda del orden de un segundo por longitud y sólo compensa si el proceso reutiliza
+# muchas veces la misma n (main.py procesa una configuración por proceso).
+FFTW_PLANNER_EFFORT = 'FFTW_ESTIMATE'
+
+# Los planes comparten sus buffers de entrada y salida entre llamadas: el lock evita
+# que dos hilos usen a la vez el mismo plan.
+_plan_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=16)
+def _get_plan(n, dtype, threads):
+    """
+    Devuelve un plan FFTW 1D (rfft de longitud n) para entradas reales de tipo 'dtype'.
+    El plan se indexa sólo por n y tipo (no por el número de señales del lote), así que
+    se reutiliza para cualquier número de micrófonos. No es seguro entre hilos: usarlo
+    siempre con _plan_lock.
+    """
+    dtype = np.dtype(dtype)
+    a = pyfftw.empty_aligned(n, dtype=dtype)
+    b = pyfftw.empty_aligned(n // 2 + 1, dtype=np.result_type(dtype, np.complex64))
+    return pyfftw.FFTW(a, b, flags=(FFTW_PLANNER_EFFORT,), threads=threads)
+
+def _gcc_weighting(SIG1, SIG2, method, MAG1=None, MAG2=None, R=None, out=None):
+    """
+    Devuelve el espectro cruzado SIG1 * conj(SIG2) ponderado con PHAT o SCOT
+    ('cc' lo devuelve sin ponderar: correlación cruzada clásica).
+    SIG1 y SIG2 pueden ser espectros 1D o lotes 2D (un par por fila).
+    MAG1 y MAG2 son las magnitudes |SIG|, si ya se calcularon (sólo SCOT sin Numba).
+    R es el espectro cruzado sin ponderar, si ya se calculó; no se modifica.
+    out es un buffer opcional (contiguo, misma forma y tipo que SIG1) donde escribir
+    el resultado de PHAT/SCOT, para reutilizarlo entre llamadas.
+    """
+    method = method.lower()
+    if method not in ('cc', 'phat', 'scot'):
+        raise ValueError("Método GCC no reconocido. Use 'cc', 'phat' o 'scot'.")
+
+    if method == 'cc':
+        return SIG1 * np.conj(SIG2) if R is None else R
+
+    # El kernel de Numba escribe en out.ravel(), que para un buffer no contiguo es una
+    # copia: se exige el mismo buffer en ambos caminos para que no den resultados distintos.
+    if out is not None and (out.shape != SIG1.shape or out.dtype != SIG1.dtype
+                            or not out.flags.c_contiguous):
+        raise ValueError("El buffer 'out' debe ser C-contiguo y tener la misma forma y tipo que SIG1.")
+
+    if phat_normalize is not None:
+        # Una sola pasada sobre el semiespectro, escribiendo en un buffer preasignado
+        if out is None:
+            out = np.empty_like(SIG1)
+        kernel = phat_normalize if method == 'phat' else scot_normalize
+        kernel(SIG1.ravel(), SIG2.ravel(), out.ravel())
+        return out
+
+    if R is None:
+        R = SIG1 * np.conj(SIG2)
+    # Sin Numba, el denominador se construye en un único buffer con operaciones in-place
+    # para no crear un array temporal del tamaño del espectro por cada operación.
+    if method == 'phat':
+        # Transformada de Fase: normaliza por la magnitud del espectro cruzado
+        den = np.abs(R)
+    else:
+        # SCOT: normaliza por la raíz cuadrada del producto de las auto-potencias espectrales,
+        # sqrt(|SIG1|^2 * |SIG2|^2) = |SIG1| * |SIG2|. Se usan las magnitudes directamente:
+        # el producto de potencias pequeñas puede quedar por debajo del rango de float32.
+        den = np.multiply(MAG1 if MAG1 is not None else np.abs(SIG1),
+                          MAG2 if MAG2 is not None else np.abs(SIG2))
+    den += 1e-10 # Añadir epsilon para evitar división por cero
+    return np.divide(R, den, out=out)
+
+def _interpolated_peak(cc, lags_vector, fs):
+    """
+    Localiza el máximo de la correlación cc (a lo largo del último eje) y lo refina
+    con un ajuste parabólico de 3 puntos, para obtener resolución sub-muestra.
+    Devuelve el lag del pico en segundos (un escalar, o un array si cc es 2D).
+    """
+    tdoa_index = np.argmax(cc, axis=-1)
+    n = cc.shape[-1]
+    if n < 3:
+        return lags_vector[tdoa_index]
+
+    # Vecinos del pico; en los bordes no hay vecino y el pico se deja sin interpolar
+    center = np.clip(tdoa_index, 1, n - 2)[..., np.newaxis]
+    y_m1 = np.take_along_axis(cc, center - 1, axis=-1)[..., 0]
+    y_0 = np.take_along_axis(cc, center, axis=-1)[..., 0]
+    y_p1 = np.take_along_axis(cc, center + 1, axis=-1)[..., 0]
+
+    den = y_m1 - 2 * y_0 + y_p1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(den != 0, 0.5 * (y_m1 - y_p1) / den, 0.0)
+    delta = np.where((tdoa_index == 0) | (tdoa_index == n - 1), 0.0, delta)
+
+    return lags_vector[tdoa_index] + delta / fs
 
 def estimate_tdoa_cc(sig1, sig2, fs):
     """
     Estima el TDOA entre dos señales usando correlación cruzada clásica.
+    La correlación se calcula en el dominio de la frecuencia (O(N log N)).
     Devuelve el TDOA en segundos.
     """
     # Asegurarse de que las señales sean 1D arrays
     sig1 = np.asarray(sig1).flatten()
     sig2 = np.asarray(sig2).flatten()
 
-    corr = correlate(sig1, sig2, mode='full')
-    # correlation_lags devuelve los lags en muestras, dividimos por fs para obtener segundos
-    lags_samples = correlation_lags(len(sig1), len(sig2), mode='full')
-    lags_seconds = lags_samples / fs
-    tdoa = lags_seconds[np.argmax(corr)]
+    # Longitud de la FFT: potencia de dos >= longitud de la correlación lineal,
+    # así se evita el aliasing circular y la FFT usa su camino rápido
+    n = 1 << int(np.ceil(np.log2(len(sig1) + len(sig2) - 1)))
+
+    R = rfft(sig1, n, workers=FFT_WORKERS) * np.conj(rfft(sig2, n, workers=FFT_WORKERS))
+    cc = irfft(R, n, workers=FFT_WORKERS)
+
+    # Reordenar la correlación circular como la 'full' de correlate: los lags negativos
+    # -(len(sig2) - 1)..-1 están al final de cc y los lags 0..len(sig1) - 1 al principio.
+    # Así el lag de cada índice no depende de que el retardo quepa en ±n // 2, que
+    # falla cuando las señales tienen longitudes muy distintas.
+    cc = np.concatenate((cc[n - (len(sig2) - 1):], cc[:len(sig1)]))
+    lags_vector = np.arange(-(len(sig2) - 1), len(sig1)) / fs # = correlation_lags(len(sig1), len(sig2), 'full') / fs
+    tdoa = _interpolated_peak(cc, lags_vector, fs)
     return tdoa
 
-def estimate_tdoa_gcc(sig1, sig2, fs, method='phat'):
+def estimate_tdoa_gcc(sig1, sig2, fs, method='phat', n=None, lags_vector=None, engine='cpu'):
     """
     Estima el TDOA entre dos señales usando Generalized Cross-Correlation (GCC).
     Permite los métodos PHAT (Phase Transform) o SCOT (Smoothed Coherence Transform).
+    n (longitud de la FFT, >= 2 * max(len(sig1), len(sig2)) - 1) y lags_vector se pueden
+    precalcular y pasar cuando se procesan muchos pares de la misma longitud y fs;
+    por defecto se calculan aquí.
+    Con engine='cuda' el cálculo se hace en GPU con PyTorch (ver tdoa_cuda.py).
     Devuelve el TDOA estimado en segundos.
     """
+    if engine not in ('cpu', 'cuda'):
+        raise ValueError("Motor no reconocido. Use 'cpu' o 'cuda'.")
+
     # Asegurarse de que las señales sean 1D arrays
     sig1 = np.asarray(sig1).flatten()
     sig2 = np.asarray(sig2).flatten()
 
-    # Longitud para la FFT, asegurando que sea suficiente para la correlación lineal
-    n = len(sig1) + len(sig2) - 1
+    # Longitud para la FFT, asegurando que sea suficiente para la correlación lineal.
+    # Se toma como si ambas señales se rellenaran con ceros hasta la longitud de la más
+    # larga (como en load_rirs): así cualquier retardo cabe en ±n // 2, que es lo que
+    # supone el vector de lags centrado (con len(sig1) + len(sig2) - 1 no basta si las
+    # longitudes son muy distintas).
+    # Se redondea a una longitud 5-smooth para que la FFT no caiga en el camino lento
+    # (Bluestein) cuando n_lin es primo o tiene factores primos grandes.
+    if n is None:
+        n_lin = 2 * max(len(sig1), len(sig2)) - 1
+        n = next_fast_len(n_lin, real=True)
 
-    SIG1 = fft(sig1, n=n)
-    SIG2 = fft(sig2, n=n)
+    if engine == 'cuda':
+        # Import diferido: PyTorch sólo se necesita para el motor GPU
+        from tdoa_cuda import estimate_tdoa_gcc_cuda
+        signals = np.zeros((2, max(len(sig1), len(sig2))), dtype=np.result_type(sig1, sig2))
+        signals[0, :len(sig1)] = sig1
+        signals[1, :len(sig2)] = sig2
+        return estimate_tdoa_gcc_cuda(signals, [(0, 1)], fs, methods=(method,), n=n)[method.lower()][0]
 
-    R = SIG1 * np.conj(SIG2)
+    SIG1, MAG1 = _compute_spectra(sig1, n)
+    SIG2, MAG2 = _compute_spectra(sig2, n)
 
-    if method.lower() == 'phat':
-        # Transformada de Fase: normaliza por la magnitud del espectro cruzado
-        R_abs = np.abs(R)
-        R = R / (R_abs + 1e-10) # Añadir epsilon para evitar división por cero
-    elif method.lower() == 'scot':
-        # SCOT: normaliza por la raíz cuadrada del producto de las auto-potencias espectrales
-        P1 = np.abs(SIG1)**2
-        P2 = np.abs(SIG2)**2
-        den = np.sqrt(P1 * P2)
-        R = R / (den + 1e-10) # Añadir epsilon
+    tdoa = _gcc_from_spectra(SIG1, SIG2, MAG1, MAG2, method, n, fs, lags_vector)
+
+    return tdoa
+
+def _compute_spectra(sig, n, workers=FFT_WORKERS):
+    """
+    Calcula el espectro rfft de longitud n (a lo largo del último eje) y su
+    magnitud |SIG|, para reutilizarlos entre pares y métodos GCC.
+    Las señales son reales: basta con la mitad del espectro (n // 2 + 1 bins).
+    """
+    sig = np.asarray(sig)
+    if pyfftw is not None and sig.dtype in (np.float32, np.float64):
+        threads = os.cpu_count() if workers is None or workers < 0 else workers
+        plan = _get_plan(n, sig.dtype, threads)
+        length = min(sig.shape[-1], n)
+        rows = sig.reshape(-1, sig.shape[-1])
+        SIG = np.empty((rows.shape[0], n // 2 + 1), dtype=plan.output_array.dtype)
+        with _plan_lock:
+            for i, row in enumerate(rows):
+                # Copiar la señal al buffer alineado del plan, rellenando con ceros hasta n
+                plan.input_array[:length] = row[:length]
+                plan.input_array[length:] = 0
+                SIG[i] = plan() # El buffer de salida del plan se reutiliza en la próxima llamada
+        SIG = SIG.reshape(sig.shape[:-1] + (n // 2 + 1,))
     else:
-        raise ValueError("Método GCC no reconocido. Use 'phat' o 'scot'.")
+        SIG = rfft(sig, n=n, axis=-1, workers=workers)
+    MAG = np.abs(SIG)
+    return SIG, MAG
 
+def _gcc_from_spectra(SIG1, SIG2, MAG1, MAG2, method, n, fs, lags_vector=None, workers=FFT_WORKERS, R_buf=None):
+    """
+    Calcula el TDOA por GCC a partir de espectros ya calculados con _compute_spectra:
+    pondera el espectro cruzado (CC, PHAT o SCOT), vuelve al dominio del tiempo y
+    localiza el pico. Acepta espectros 1D o lotes 2D (un par por fila).
+    Devuelve el TDOA en segundos (un escalar, o un array para lotes).
+    """
+    R = _gcc_weighting(SIG1, SIG2, method, MAG1=MAG1, MAG2=MAG2, out=R_buf)
+    return _tdoa_from_cross_spectrum(R, n, fs, lags_vector, workers)
+
+def _all_from_spectra(SIG1, SIG2, MAG1, MAG2, n, fs, lags_vector=None, workers=FFT_WORKERS, R_buf=None):
+    """
+    Calcula los TDOA por CC, PHAT y SCOT a partir de los mismos espectros: el espectro
+    cruzado se forma una sola vez y sólo cambia la ponderación antes de cada IFFT.
+    Acepta espectros 1D o lotes 2D (un par por fila). PHAT y SCOT escriben su espectro
+    ponderado en el mismo buffer R_buf (se crea aquí si no se pasa uno).
+    Devuelve un diccionario {'cc': tdoa, 'phat': tdoa, 'scot': tdoa} (en segundos).
+    """
+    # Espectro cruzado sin ponderar (CC), formado sin temporales intermedios
+    R_cc = np.conjugate(SIG2)
+    R_cc *= SIG1
+    if R_buf is None:
+        R_buf = np.empty_like(R_cc)
+
+    tdoas = {'cc': _tdoa_from_cross_spectrum(R_cc, n, fs, lags_vector, workers)}
+    for method in ('phat', 'scot'):
+        # Cada IFFT consume R_buf antes de que el siguiente método lo sobrescriba
+        R = _gcc_weighting(SIG1, SIG2, method, MAG1=MAG1, MAG2=MAG2, R=R_cc, out=R_buf)
+        tdoas[method] = _tdoa_from_cross_spectrum(R, n, fs, lags_vector, workers)
+    return tdoas
+
+def _tdoa_from_cross_spectrum(R, n, fs, lags_vector=None, workers=FFT_WORKERS):
+    """
+    Vuelve al dominio del tiempo el espectro cruzado (ya ponderado) R y devuelve el
+    lag del pico en segundos (un escalar, o un array si R es un lote 2D).
+    """
     # Correlación cruzada en el dominio del tiempo
-    cc = fftshift(ifft(R).real) # Tomar la parte real y aplicar fftshift para centrar el lag cero
-
-    # Crear el vector de lags en segundos
-    # El resultado de ifft(R) tiene longitud n. fftshift lo centra.
-    # Los lags van de -n/2 a n/2 (aproximadamente)
-    lags_samples = np.arange(-n//2, n//2 + n%2) # Ajuste para n par/impar si es necesario, pero linspace es más robusto
-    if n % 2 == 0: # n es par, el centro no es un único punto
-        lags_samples = np.arange(-n//2, n//2)
-    else: # n es impar, el centro es 0
-        lags_samples = np.arange(-(n-1)//2, (n-1)//2 + 1)
-
-    # Usar np.linspace es generalmente más seguro para generar lags simétricos para fftshift
-    # El rango de lags después de fftshift es de aproximadamente - (n/2)/fs a + (n/2)/fs
-    # Para n impar, lags_samples va de -(n-1)/2 a (n-1)/2.
-    # Para n par, lags_samples va de -n/2 a n/2 - 1.
-    # np.fft.fftfreq(n, d=1/fs) genera frecuencias, np.fft.fftshift las centra.
-    # Los lags correspondientes al resultado de ifft(fft(sig1)*conj(fft(sig2)))
-    # y luego fftshift, si n es la longitud de la fft:
-    # lags = np.arange(-n // 2, n - n // 2) / fs # Esto no es del todo correcto con fftshift
-    # La forma correcta con fftshift es que el índice 0 corresponde a lag 0 (DC),
-    # luego vienen los lags positivos, y luego los negativos envueltos.
-    # fftshift reordena esto a [-fs/2, fs/2] (en términos de frecuencia).
-    # Para lags de tiempo, el centro de `cc` (después de fftshift) es el lag cero.
-
-    # Generar lags de forma que el centro del array 'cc' corresponda al lag 0.
-    # Si n es la longitud de la FFT, cc también tiene longitud n.
-    # El índice central de cc (después de fftshift) es n // 2.
-    # Este índice central debe corresponder a un lag de 0.
-    # Los índices de 0 a n//2 -1 son lags negativos.
-    # Los índices de n//2 + 1 a n-1 son lags positivos.
-
-    # Ejemplo de lags para fftshift:
-    # Si N es la longitud de la señal (después de padding para FFT)
-    # lags_indices = np.arange(N) - N // 2
-    # lags_sec = lags_indices / fs
-    # Esta es la forma más común de generar lags para un resultado de IFFT que ha sido `fftshift`eado.
-    lags_vector = (np.arange(n) - n // 2) / fs
-
-
-    tdoa_index = np.argmax(cc)
-    tdoa = lags_vector[tdoa_index]
-
-    return tdoa
\ No newline at end of file
+    cc = fftshift(irfft(R, n=n, axis=-1, workers=workers), axes=-1) # irfft ya devuelve una señal real; fftshift centra el lag cero
+
+    # Crear el vector de lags en segundos (si no se recibió ya precalculado).
+    # El resultado de irfft(R, n) tiene longitud n y fftshift lo centra: el índice
+    # n // 2 corresponde al lag cero, los anteriores a lags negativos y los
+    # posteriores a lags positivos. Esto sólo es correcto si todo retardo posible cabe
+    # en ±n // 2, es decir, si n >= 2 * max(len(sig1), len(sig2)) - 1 (señales rellenadas
+    # a una longitud común). n >= len(sig1) + len(sig2) - 1 evita el aliasing circular,
+    # pero con longitudes distintas un retardo mayor que n // 2 aparecería envuelto.
+    if lags_vector is None:
+        lags_vector = (np.arange(n) - n // 2) / fs
+
+    return _interpolated_peak(cc, lags_vector, fs)
+
+def estimate_tdoa_all(sig1, sig2, fs, n=None, lags_vector=None, workers=FFT_WORKERS):
+    """
+    Estima el TDOA entre dos señales con los tres métodos (CC clásica, GCC-PHAT y
+    GCC-SCOT) usando una única FFT por señal: los tres comparten los espectros y el
+    espectro cruzado, y sólo difieren en la ponderación previa a la IFFT.
+    n y lags_vector son opcionales, como en estimate_tdoa_gcc.
+    Devuelve un diccionario {'cc': tdoa, 'phat': tdoa, 'scot': tdoa} en segundos.
+    """
+    # Asegurarse de que las señales sean 1D arrays
+    sig1 = np.asarray(sig1).flatten()
+    sig2 = np.asarray(sig2).flatten()
+
+    # Igual que en estimate_tdoa_gcc: n suficiente para señales rellenadas a la longitud
+    # de la más larga, para que el retardo de 'cc' (y de PHAT/SCOT) quepa en ±n // 2
+    if n is None:
+        n = next_fast_len(2 * max(len(sig1), len(sig2)) - 1, real=True)
+
+    SIG1, MAG1 = _compute_spectra(sig1, n, workers)
+    SIG2, MAG2 = _compute_spectra(sig2, n, workers)
+
+    return _all_from_spectra(SIG1, SIG2, MAG1, MAG2, n, fs, lags_vector, workers)
+
+def compute_spectra(signals, n=None, workers=FFT_WORKERS):
+    """
+    Calcula en una sola FFT por lotes los espectros de varias señales (una por fila)
+    y sus magnitudes, para reutilizarlos entre pares y métodos GCC.
+    Si n es None se usa la longitud rápida suficiente para la correlación lineal
+    entre dos filas: next_fast_len(2N - 1).
+    Devuelve (SIG, MAG, n): espectros rfft, |SIG| y la longitud de FFT utilizada.
+    """
+    signals = np.asarray(signals)
+    if n is None:
+        n = next_fast_len(2 * signals.shape[-1] - 1, real=True)
+
+    SIG, MAG = _compute_spectra(signals, n, workers)
+    return SIG, MAG, n
+
+def estimate_tdoa_gcc_batch(SIG, MAG, pairs, n, fs, method='phat', lags_vector=None, workers=FFT_WORKERS, R_buf=None):
+    """
+    Estima el TDOA con GCC (PHAT o SCOT) o correlación cruzada clásica ('cc') para
+    varios pares de micrófonos a la vez, a partir de los espectros ya calculados con
+    compute_spectra.
+    pairs es una secuencia de tuplas (i, j) de índices de fila en SIG / MAG.
+    lags_vector puede precalcularse una vez por configuración; si es None se calcula.
+    Los pares son independientes: la IFFT por lotes reparte las filas (un par por
+    fila) entre 'workers' hilos, de modo que los pares se procesan en paralelo.
+    R_buf es un buffer opcional para el espectro ponderado, reutilizable entre llamadas
+    con la misma forma: debe ser C-contiguo, de forma len(pairs) x (n // 2 + 1) y del
+    mismo tipo que SIG (si no, se lanza ValueError).
+    Devuelve un array con el TDOA en segundos de cada par, en el orden de pairs.
+    """
+    pairs = np.asarray(pairs)
+    idx1, idx2 = pairs[:, 0], pairs[:, 1]
+
+    # Se reutilizan los espectros y magnitudes ya calculados para cada señal;
+    # la IFFT se hace por lotes para todos los pares en una sola llamada.
+    return _gcc_from_spectra(SIG[idx1], SIG[idx2], MAG[idx1], MAG[idx2], method, n, fs, lags_vector, workers, R_buf)
+
+def estimate_tdoa_all_batch(SIG, MAG, pairs, n, fs, lags_vector=None, workers=FFT_WORKERS, R_buf=None):
+    """
+    Versión por lotes de estimate_tdoa_all: TDOA por CC, PHAT y SCOT de varios pares
+    a la vez, a partir de los espectros ya calculados con compute_spectra.
+    R_buf es un buffer opcional, compartido por PHAT y SCOT, con los mismos requisitos
+    que en estimate_tdoa_gcc_batch (C-contiguo, len(pairs) x (n // 2 + 1), tipo de SIG).
+    Devuelve un diccionario {'cc': array, 'phat': array, 'scot': array} con el TDOA
+    en segundos de cada par, en el orden de pairs.
+    """
+    pairs = np.asarray(pairs)
+    idx1, idx2 = pairs[:, 0], pairs[:, 1]
+
+    return _all_from_spectra(SIG[idx1], SIG[idx2], MAG[idx1], MAG[idx2], n, fs, lags_vector, workers, R_buf)
@@ -0,0 +1,67 @@
+import numpy as np
+import torch
+from scipy.fft import next_fast_len
+
+# Estimación de TDOA en GPU con PyTorch (engine='cuda' en tdoa.py y main.py).
+# Todo el pipeline (FFT por lotes, ponderación CC/PHAT/SCOT, IFFT, búsqueda del pico
+# e interpolación parabólica) se ejecuta en el dispositivo; a la CPU sólo vuelven
+# los TDOAs escalares de cada par.
+
+EPS = 1e-10 # Epsilon para evitar división por cero (igual que en tdoa.py)
+
+def estimate_tdoa_gcc_cuda(signals, pairs, fs, methods=('phat',), n=None, device='cuda'):
+    """
+    Estima el TDOA de varios pares de señales en GPU, con uno o varios métodos
+    ('cc', 'phat' o 'scot') a partir de una única FFT por lotes de todas las señales.
+    signals es una matriz M x N (una señal por fila) y pairs una secuencia de tuplas
+    (i, j) de índices de fila. n es la longitud de la FFT (por defecto
+    next_fast_len(2N - 1)).
+    Devuelve un diccionario {método: array con el TDOA en segundos de cada par}.
+    """
+    x = torch.as_tensor(np.asarray(signals), device=device)
+    if n is None:
+        n = next_fast_len(2 * x.shape[-1] - 1, real=True)
+
+    pairs = torch.as_tensor(np.asarray(pairs), device=device)
+    SIG = torch.fft.rfft(x, n=n, dim=-1)
+    SIG1, SIG2 = SIG[pairs[:, 0]], SIG[pairs[:, 1]]
+    R_cc = SIG1 * SIG2.conj()
+
+    tdoas = {}
+    for method in methods:
+        method = method.lower()
+        if method == 'cc':
+            R = R_cc
+        elif method == 'phat':
+            R = R_cc / (R_cc.abs() + EPS)
+        elif method == 'scot':
+            R = R_cc / (SIG1.abs() * SIG2.abs() + EPS)
+        else:
+            raise ValueError("Método GCC no reconocido. Use 'cc', 'phat' o 'scot'.")
+
+        cc = torch.fft.fftshift(torch.fft.irfft(R, n=n, dim=-1), dim=-1)
+        tdoas[method] = _interpolated_peak(cc, n, fs).cpu().numpy()
+
+    return tdoas
+
+def _interpolated_peak(cc, n, fs):
+    """
+    Versión en PyTorch de tdoa._interpolated_peak: máximo de cada fila de cc
+    refinado con un ajuste parabólico de 3 puntos. Devuelve los lags en segundos.
+    """
+    tdoa_index = torch.argmax(cc, dim=-1)
+    lags = (tdoa_index - n // 2).to(torch.float64)
+    if n < 3:
+        return lags / fs
+
+    # Vecinos del pico; en los bordes no hay vecino y el pico se deja sin interpolar
+    center = tdoa_index.clamp(1, n - 2).unsqueeze(-1)
+    y_m1 = cc.gather(-1, center - 1).squeeze(-1)
+    y_0 = cc.gather(-1, center).squeeze(-1)
+    y_p1 = cc.gather(-1, center + 1).squeeze(-1)
+
+    den = y_m1 - 2 * y_0 + y_p1
+    delta = torch.where(den != 0, 0.5 * (y_m1 - y_p1) / den, torch.zeros_like(den))
+    delta = torch.where((tdoa_index == 0) | (tdoa_index == n - 1), torch.zeros_like(delta), delta)
+
+    return (lags + delta.to(torch.float64)) / fs
@@ -0,0 +1,35 @@
+import numpy as np
+from numba import njit, prange
+
+# Kernels compilados con Numba para la ponderación GCC.
+# Cada kernel recorre el semiespectro una sola vez y fusiona el espectro cruzado,
+# la magnitud, la división con epsilon y el escalado, sin crear arrays temporales.
+# Trabajan sobre arrays 1D; para lotes de pares se les pasan los arrays aplanados.
+
+# Epsilon para evitar división por cero (igual que en tdoa.py). En float32 para no
+# promover a doble precisión los cálculos sobre espectros complex64.
+EPS = np.float32(1e-10)
+
+@njit(parallel=True, fastmath=True, cache=True)
+def phat_normalize(SIG1, SIG2, out):
+    """
+    PHAT: out[k] = R[k] / |R[k]|, con R = SIG1 * conj(SIG2).
+    Escribe el resultado en 'out' (misma forma y tipo que SIG1) y lo devuelve.
+    """
+    for k in prange(len(SIG1)):
+        r = SIG1[k] * SIG2[k].conjugate()
+        out[k] = r / (abs(r) + EPS)
+    return out
+
+@njit(parallel=True, fastmath=True, cache=True)
+def scot_normalize(SIG1, SIG2, out):
+    """
+    SCOT: out[k] = R[k] / sqrt(P1[k] * P2[k]), con R = SIG1 * conj(SIG2) y P = |SIG|^2.
+    sqrt(P1 * P2) = |SIG1| * |SIG2|, así que no hace falta calcular las auto-potencias.
+    Escribe el resultado en 'out' (misma forma y tipo que SIG1) y lo devuelve.
+    """
+    for k in prange(len(SIG1)):
+        s1 = SIG1[k]
+        s2 = SIG2[k]
+        out[k] = s1 * s2.conjugate() / (abs(s1) * abs(s2) + EPS)
+    return out